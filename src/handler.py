@@ -1,6 +1,8 @@
 """ Example handler file. """
+import io
 import os
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import runpod
 from dotenv import load_dotenv
@@ -10,13 +12,17 @@ from textractor.entities.document import Document
 from textractor.entities.table import Table
 from textractor.visualizers import EntityList
 
-from helper import merge_matching_columns, to_excel, s3_upload, delete_s3_folder, s3_delete_old_files
+# Load .env before importing helper so AWS credentials are visible to its S3 client
+load_dotenv()
+
+from helper import (merge_matching_columns, to_excel, s3_upload, s3_upload_fileobj, delete_s3_folder,
+                    s3_delete_old_files)
 
 # If your handler runs inference on a model, load the model here.
 # You will want models to be loaded into memory before starting serverless.
 
-load_dotenv()
 S3_BUCKET_NAME = os.environ.get("AWS_BUCKET_NAME")
+textractor_client = Textractor(region_name='ap-south-1')
 
 
 def handler(job):
@@ -41,30 +47,38 @@ def handler(job):
     document_id = job_input.get('document_id')
     job_id = job_input.get('job_id')
     user_id = job_input.get('user_id')
-    textractor_client = Textractor(region_name='ap-south-1')
-    temp_dir = Path(tempfile.mkdtemp())
-    excel_file_path = Path(temp_dir) / f'{document_id}.xlsx'
-    excel_table_path = Path(temp_dir) / f'{document_id}_table.xlsx'
-    detect: Document = textractor_client.get_result(job_id=job_id, api=TextractAPI.ANALYZE)
-    detect.export_tables_to_excel(excel_table_path)
-    tables: EntityList[Table] = detect.tables
-    data_frames = []
-    for table in tables:
-        data_frames.append(table.to_pandas(use_columns=True))
-
-    merged_tables = merge_matching_columns(data_frames)
-
-    to_excel(file_path=excel_file_path, tables=merged_tables)
-
-    s3_upload(file_path=excel_file_path, bucket_name=S3_BUCKET_NAME,
-              file_name=f'{user_id}/excel/{document_id}.xlsx')
-    s3_upload(file_path=excel_table_path, bucket_name=S3_BUCKET_NAME,
-              file_name=f'{user_id}/excel/{document_id}_table.xlsx')
-    delete_s3_folder(bucket_name=S3_BUCKET_NAME,
-                     folder_prefix=f'{user_id}/excel/{job_id}')
-    s3_delete_old_files(bucket_name=S3_BUCKET_NAME, folder_path=f'{user_id}/')
-    os.remove(excel_file_path)
-    os.remove(excel_table_path)
+    # Textractor can only export to a path, the merged workbook stays in memory
+    with tempfile.TemporaryDirectory() as temp_dir, ThreadPoolExecutor(max_workers=4) as s3_executor:
+        excel_table_path = Path(temp_dir) / f'{document_id}_table.xlsx'
+        detect: Document = textractor_client.get_result(job_id=job_id, api=TextractAPI.ANALYZE)
+        # Textract is done with its input now, clean up while the workbooks are built
+        futures = [
+            s3_executor.submit(delete_s3_folder, bucket_name=S3_BUCKET_NAME,
+                               folder_prefix=f'{user_id}/excel/{job_id}'),
+            s3_executor.submit(s3_delete_old_files, bucket_name=S3_BUCKET_NAME, folder_path=f'{user_id}/'),
+        ]
+        tables: EntityList[Table] = detect.tables
+        # Overlap the Textractor workbook export with building the DataFrames
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            export_future = executor.submit(detect.export_tables_to_excel, str(excel_table_path))
+            data_frames = list(executor.map(lambda table: table.to_pandas(use_columns=True), tables))
+            export_future.result()
+
+        merged_tables = merge_matching_columns(data_frames)
+
+        excel_buffer = io.BytesIO()
+        to_excel(file_path=excel_buffer, tables=merged_tables)
+        excel_buffer.seek(0)
+
+        futures += [
+            s3_executor.submit(s3_upload_fileobj, file_obj=excel_buffer, bucket_name=S3_BUCKET_NAME,
+                               file_name=f'{user_id}/excel/{document_id}.xlsx'),
+            s3_executor.submit(s3_upload, file_path=excel_table_path, bucket_name=S3_BUCKET_NAME,
+                               file_name=f'{user_id}/excel/{document_id}_table.xlsx'),
+        ]
+        # Surface any S3 error raised inside the workers
+        for future in futures:
+            future.result()
 
     return {"refresh_worker": False, "job_results": {"user_id": f"{user_id}", "doc_id": f"{document_id}"}}
 
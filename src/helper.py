@@ -2,88 +2,192 @@ import os
 import re
 import shutil
 import tempfile
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 from urllib.parse import urlparse
 import boto3
 import pandas as pd
 import requests
-
-
-def delete_s3_folder(bucket_name, folder_prefix):
-    s3 = boto3.client('s3')
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+
+# Generated workbooks are well under the multipart threshold, so skip the transfer thread pool
+transfer_config = TransferConfig(use_threads=False, multipart_threshold=64 * 1024 * 1024)
+ALLOWED_EXTENSIONS = ('.png', '.pdf', '.jpeg', '.jpg')
+DOWNLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+DOWNLOAD_BUFFER_SIZE = 1024 * 1024
+download_config = TransferConfig(max_concurrency=10, multipart_threshold=DOWNLOAD_CHUNK_SIZE,
+                                 multipart_chunksize=DOWNLOAD_CHUNK_SIZE)
+DATE_COLUMN_PATTERN = re.compile(r'\bdate\b', re.IGNORECASE)
+SHEET_NAME_PATTERN = re.compile(r'[^a-zA-Z0-9_]')
+CURRENCY_PATTERN = re.compile(r'[\$,€,¥,£,₹]')
+
+
+@lru_cache(maxsize=None)
+def get_s3_client():
+    # boto3 clients are thread-safe, so a single client is shared by all S3 helpers.
+    # It is built on first use so credentials loaded from .env after import are picked up.
+    return boto3.session.Session(region_name='ap-south-1').client(
+        's3', config=Config(max_pool_connections=50, retries={'max_attempts': 5, 'mode': 'adaptive'},
+                            tcp_keepalive=True))
+
+
+def delete_s3_keys(bucket_name, keys, s3=None, batch_size=1000):
+    s3 = s3 or get_s3_client()
+    deleted_keys = []
+    # delete_objects accepts at most 1000 keys per request
+    for start in range(0, len(keys), batch_size):
+        batch = keys[start:start + batch_size]
+        response = s3.delete_objects(Bucket=bucket_name, Delete={'Objects': [{'Key': key} for key in batch]})
+        # Failures come back per key in a 200 response instead of raising
+        failed_keys = set()
+        for error in response.get('Errors', []):
+            failed_keys.add(error['Key'])
+            print(f"Error deleting file: {error['Key']} ({error.get('Code')}: {error.get('Message')})")
+        deleted_keys.extend(key for key in batch if key not in failed_keys)
+    return deleted_keys
+
+
+def delete_s3_folder(bucket_name, folder_prefix, s3=None):
+    s3 = s3 or get_s3_client()
     # List objects within the folder prefix
-    objects_to_delete = s3.list_objects_v2(Bucket=bucket_name, Prefix=folder_prefix)
-
-    # If there are objects, delete them
-    if 'Contents' in objects_to_delete:
-        delete_keys = {'Objects': [{'Key': obj['Key']} for obj in objects_to_delete['Contents']]}
-        s3.delete_objects(Bucket=bucket_name, Delete=delete_keys)
-
-    # Delete the folder (prefix)
-    s3.delete_object(Bucket=bucket_name, Key=folder_prefix)
+    paginator = s3.get_paginator('list_objects_v2')
+    keys = []
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=folder_prefix, PaginationConfig={'PageSize': 1000}):
+        keys.extend(obj['Key'] for obj in page.get('Contents', []))
+
+    # If there are objects, delete them (the prefix itself is not an object)
+    delete_s3_keys(bucket_name, keys, s3=s3)
+
+
+def download_range(url, file_path, start, end):
+    headers = {'Range': f'bytes={start}-{end}'}
+    with requests.get(url, headers=headers, stream=True) as response:
+        response.raise_for_status()
+        # A server that ignores Range answers 200 with the whole body, which must not be written at offset
+        content_range = response.headers.get('Content-Range', '')
+        if response.status_code != 206 or not content_range.startswith(f'bytes {start}-{end}/'):
+            return False
+        fd = os.open(file_path, os.O_WRONLY)
+        try:
+            offset = start
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_BUFFER_SIZE):
+                os.pwrite(fd, chunk, offset)
+                offset += len(chunk)
+        finally:
+            os.close(fd)
+    # A short body leaves a hole in the file, let the caller fall back to a full download
+    return offset == end + 1
 
 
 def download_large_file(url):
     try:
-        response = requests.get(url, stream=True)
         a = urlparse(url)
         uploaded_file_path = os.path.join(tempfile.gettempdir(), os.path.basename(a.path))
-        with open(uploaded_file_path, 'wb') as out_file:
-            shutil.copyfileobj(response.raw, out_file)
+        if a.scheme == 's3':
+            get_s3_client().download_file(a.netloc, a.path.lstrip('/'), uploaded_file_path, Config=download_config)
+            print("File downloaded successfully!")
+            return uploaded_file_path
+
+        # Probe with a one-byte GET, HEAD is rejected by presigned GET URLs since SigV4 signs the method
+        probe = requests.get(url, headers={'Range': 'bytes=0-0'}, stream=True)
+        probe.raise_for_status()
+        # Content-Range is 'bytes 0-0/<total>', the total may be '*' when unknown
+        total = probe.headers.get('Content-Range', '').rsplit('/', 1)[-1]
+        size = int(total) if probe.status_code == 206 and total.isdigit() else 0
+        if probe.status_code == 200:
+            # Ranges are not supported and the probe already carries the whole body
+            with probe, open(uploaded_file_path, 'wb') as out_file:
+                shutil.copyfileobj(probe.raw, out_file, length=DOWNLOAD_BUFFER_SIZE)
+            print("File downloaded successfully!")
+            return uploaded_file_path
+        probe.close()
+
+        ranged = False
+        if size > DOWNLOAD_CHUNK_SIZE:
+            # Fetch byte ranges in parallel into a pre-allocated file
+            with open(uploaded_file_path, 'wb') as out_file:
+                out_file.truncate(size)
+            ranges = [(start, min(start + DOWNLOAD_CHUNK_SIZE, size) - 1)
+                      for start in range(0, size, DOWNLOAD_CHUNK_SIZE)]
+            with ThreadPoolExecutor(max_workers=10) as executor:
+                futures = [executor.submit(download_range, url, uploaded_file_path, start, end)
+                           for start, end in ranges]
+            ranged = all([future.result() for future in futures])
+        if not ranged:
+            with requests.get(url, stream=True) as response:
+                with open(uploaded_file_path, 'wb') as out_file:
+                    shutil.copyfileobj(response.raw, out_file, length=DOWNLOAD_BUFFER_SIZE)
         print("File downloaded successfully!")
         return uploaded_file_path
-    except requests.exceptions.RequestException as e:
+    except (requests.exceptions.RequestException, BotoCoreError, ClientError) as e:
         print("Error downloading the file:", e)
 
 
 def to_excel(file_path, tables):
-    with pd.ExcelWriter(file_path) as writer:
+    # Write +/-inf as #NUM! instead of raising, and give datetimes a date format like pandas does
+    workbook_options = {'nan_inf_to_errors': True, 'default_date_format': 'yyyy-mm-dd hh:mm:ss'}
+    with pd.ExcelWriter(file_path, engine='xlsxwriter', engine_kwargs={'options': workbook_options}) as writer:
+        # Same look as the pandas header style
+        header_format = writer.book.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
         for idx, table in enumerate(tables):
-            columns = table.columns.values.tolist()
+            columns = table.columns
             is_header = True
             sheet_name = f'Summary_{idx + 1}'
             if contains_only_numbers(columns):
                 is_header = False
-            else:
-                date_pattern = re.compile(r'\bdate\b', re.IGNORECASE)
-                # Iterate over the list and check if any string matches the pattern
-                for header in columns:
-                    if isinstance(header, str) and re.search(date_pattern, header):
-                        sheet_name = f'Transaction_{idx + 1}'
-            table.to_excel(writer, sheet_name=f'{sheet_name}', header=is_header, index=False)
+            elif columns.astype(str).str.contains(DATE_COLUMN_PATTERN).any():
+                # A header mentioning a date marks a transaction table
+                sheet_name = f'Transaction_{idx + 1}'
+            worksheet = writer.book.add_worksheet(sheet_name)
+            row_idx = 0
+            if is_header:
+                worksheet.write_row(row_idx, 0, columns, header_format)
+                row_idx += 1
+            # Write rows straight to xlsxwriter, NaN cells are left blank like pandas does
+            values = table.astype(object).where(table.notna(), None)
+            for row in values.itertuples(index=False, name=None):
+                worksheet.write_row(row_idx, 0, row)
+                row_idx += 1
 
 
-def s3_upload(file_path, bucket_name, file_name):
-    s3 = boto3.client('s3', region_name='ap-south-1')
-    s3.upload_file(file_path, bucket_name, file_name)
+def s3_upload(file_path, bucket_name, file_name, s3=None):
+    s3 = s3 or get_s3_client()
+    s3.upload_file(str(file_path), bucket_name, file_name, Config=transfer_config)
 
 
-def list_range(page_num) -> list:
-    return list(range(0, (page_num - 1) + 1))
+def s3_upload_fileobj(file_obj, bucket_name, file_name, s3=None):
+    s3 = s3 or get_s3_client()
+    s3.upload_fileobj(file_obj, bucket_name, file_name, Config=transfer_config)
 
 
-def s3_delete_old_files(bucket_name, folder_path, hrs=1):
-    s3 = boto3.client('s3', region_name='ap-south-1')
+def list_range(page_num) -> range:
+    return range(page_num)
+
+
+def s3_delete_old_files(bucket_name, folder_path, hrs=1, s3=None):
+    s3 = s3 or get_s3_client()
     current_time = datetime.now(timezone.utc)
     # Calculate the time 4 hours ago
     time_threshold = current_time - timedelta(hours=hrs)
-    response = s3.list_objects_v2(Bucket=bucket_name, Prefix=folder_path)
-    if 'Contents' in response:
-        for obj in response['Contents']:
-            # Extract object key and creation time
-            obj_key = obj['Key']
-            creation_time = obj['LastModified']
-            allowed_extensions = ['.png', '.pdf', '.jpeg', '.jpg']
-            # Check if the object is a PDF file and was created 4 hours ago
-            if any(obj_key.lower().endswith(ext) for ext in allowed_extensions) and creation_time < time_threshold:
-                # Delete the object
-                s3.delete_object(Bucket=bucket_name, Key=obj_key)
-                print(f"Deleted file: {obj_key}")
+    paginator = s3.get_paginator('list_objects_v2')
+    keys = []
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=folder_path, PaginationConfig={'PageSize': 1000}):
+        # Keep image/PDF uploads last modified before the threshold
+        keys.extend(obj['Key'] for obj in page.get('Contents', [])
+                    if obj['Key'].lower().endswith(ALLOWED_EXTENSIONS) and obj['LastModified'] < time_threshold)
+
+    for obj_key in delete_s3_keys(bucket_name, keys, s3=s3):
+        print(f"Deleted file: {obj_key}")
 
 
 def sanitize_sheet_name(sheet_name):
     # Remove characters not allowed in Google Sheets range notation
-    sanitized_name = re.sub(r'[^a-zA-Z0-9_]', '', sheet_name)
+    sanitized_name = SHEET_NAME_PATTERN.sub('', sheet_name)
     return sanitized_name
 
 
@@ -98,62 +202,75 @@ def export_excel_to_sheets(service, spreadsheet_id, excel_file_path):
        """
     try:
         # Read Excel file
-        xls = pd.ExcelFile(excel_file_path)
-        data = []
+        xls = pd.ExcelFile(excel_file_path, engine='calamine')
 
         sheets = [{'addSheet': {'properties': {'title': name.strip()}}} for name in xls.sheet_names]
+        # Drop the default empty sheet in the same round-trip as adding the new ones
+        empty_sheet_id = find_google_sheet_id(service, spreadsheet_id)
+        if empty_sheet_id is not None:
+            sheets.append({'deleteSheet': {'sheetId': empty_sheet_id}})
         service.spreadsheets().batchUpdate(
             spreadsheetId=spreadsheet_id,
             body={'requests': sheets}
         ).execute()
-        # Loop through each sheet in the Excel file
-        for sheet_name in xls.sheet_names:
+        parse_lock = threading.Lock()
+
+        def prepare_sheet(sheet_name):
             try:
-                # Read data from current sheet including the header
-                excel_data_df = pd.read_excel(excel_file_path, sheet_name=sheet_name, engine='openpyxl')
-                excel_data_df = excel_data_df.apply(lambda x: f'"{x}"' if isinstance(x, str) else x)
-                excel_data_df = excel_data_df.replace(r'[\$,€,¥,£,₹]', '', regex=True)
+                # Read data from current sheet including the header, the workbook reader is shared
+                with parse_lock:
+                    excel_data_df = xls.parse(sheet_name)
+                # Currency symbols can only appear in text columns
+                text_columns = excel_data_df.select_dtypes(include=['object', 'string']).columns
+                excel_data_df[text_columns] = excel_data_df[text_columns].replace(CURRENCY_PATTERN, '', regex=True)
 
                 excel_data_df = excel_data_df.fillna('')
 
                 # Prepare body for API request including the header
                 header = list(excel_data_df.columns)
 
-                if contains_only_numbers(header):
+                if contains_only_numbers(excel_data_df.columns):
                     values = excel_data_df.values.tolist()
                 else:
                     values = [header] + excel_data_df.values.tolist()
 
                 # Append data to Google Sheets
                 range_name = f"{sheet_name.strip()}!A1"  # Specify the range where you want to append the data
-                data.append({'values': values, "range": range_name})
-
                 print(f"Data from '{sheet_name}' sheet appended successfully.")
+                return {'values': values, "range": range_name}
             except pd.errors.ParserError as pe:
                 print(f"Error parsing data from '{sheet_name}' sheet:", pe)
             except Exception as e:
                 print(f"Error appending data from '{sheet_name}' sheet:", e)
+            return None
+
+        # Prepare each sheet in the Excel file in parallel
+        with ThreadPoolExecutor(max_workers=max(1, min(8, len(xls.sheet_names)))) as executor:
+            data = [sheet_data for sheet_data in executor.map(prepare_sheet, xls.sheet_names) if sheet_data]
 
         body = {"valueInputOption": "RAW", "data": data}
         service.spreadsheets().values().batchUpdate(
             spreadsheetId=spreadsheet_id,
             body=body
         ).execute()
-        delete_empty_google_sheets(service, spreadsheet_id)
     except FileNotFoundError as fe:
         print(f"Error: File '{excel_file_path}' not found.", fe)
     except Exception as e:
         print("An unexpected error occurred:", e)
 
 
-def delete_empty_google_sheets(service, spreadsheet_id, sheet_title='Sheet1'):
-    # Get the sheet ID of the sheet to delete
-    spreadsheet = service.spreadsheets().get(spreadsheetId=spreadsheet_id).execute()
-    sheet_id_to_delete = None
+def find_google_sheet_id(service, spreadsheet_id, sheet_title='Sheet1'):
+    # Only fetch sheet properties, not the whole spreadsheet
+    spreadsheet = service.spreadsheets().get(spreadsheetId=spreadsheet_id, fields='sheets.properties').execute()
     for sheet in spreadsheet['sheets']:
         if sheet['properties']['title'] == sheet_title:
-            sheet_id_to_delete = sheet['properties']['sheetId']
-            break
+            return sheet['properties']['sheetId']
+    return None
+
+
+def delete_empty_google_sheets(service, spreadsheet_id, sheet_title='Sheet1'):
+    # Get the sheet ID of the sheet to delete
+    sheet_id_to_delete = find_google_sheet_id(service, spreadsheet_id, sheet_title)
 
     # If sheet is found, delete it
     if sheet_id_to_delete is not None:
@@ -172,28 +289,21 @@ def delete_empty_google_sheets(service, spreadsheet_id, sheet_title='Sheet1'):
 
 
 def merge_matching_columns(dfs):
-    merged_dfs = []
-    while dfs:
-        df = dfs.pop(0)
-        match_columns = [col.strip() if isinstance(col, str) else col for col in df.columns]
-
-        # Find DataFrames with matching column names
-        matched_dfs = [df]
-        for i in range(len(dfs) - 1, -1, -1):
-            if list([col.strip() if isinstance(col, str) else col for col in dfs[i].columns]) == list(match_columns):
-                matched_dfs.append(dfs.pop(i))
-
-        # Merge matched DataFrames
-        if len(matched_dfs) > 1:
-            merged_df = pd.concat(matched_dfs, ignore_index=True)
-            merged_dfs.append(merged_df)
-        else:
-            merged_dfs.append(matched_dfs[0])
+    # Group DataFrames by their stripped column names, keeping first-seen order
+    groups = defaultdict(list)
+    for df in dfs:
+        match_columns = tuple(col.strip() if isinstance(col, str) else col for col in df.columns)
+        groups[match_columns].append(df)
 
-    return merged_dfs
+    # Merge matched DataFrames
+    return [pd.concat(matched_dfs, ignore_index=True) if len(matched_dfs) > 1 else matched_dfs[0]
+            for matched_dfs in groups.values()]
 
 
 def contains_only_numbers(lst):
+    # A numeric Index dtype already guarantees every label is a number
+    if isinstance(lst, pd.Index) and pd.api.types.is_numeric_dtype(lst):
+        return True
     for item in lst:
         if not isinstance(item, (int, float)):
             return False